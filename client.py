@@ -16,8 +16,9 @@
 # along with this program.  If not, see <https://www.gnu.org/licenses/>.
 #
 
-import json
-from typing import List
+import asyncio
+import os
+from typing import Any, Callable, Dict, List, Optional, Tuple, Union
 
 import zmq
 from zmq.asyncio import Context, Socket
@@ -25,11 +26,36 @@ from zmq.asyncio import Context, Socket
 from .pyservice import (ErrorCode, Metadata, ProtocolException,
                         UnknownCommandException)
 
+try:
+    import orjson
+
+    def __loads(data: Union[bytes, str]) -> Any:
+        return orjson.loads(data)
+except ImportError:
+    import json
+
+    def __loads(data: Union[bytes, str]) -> Any:
+        return json.loads(data)
+
 
 class TimeoutException(Exception):
     pass
 
 
+_METADATA_CMD = b"metadata"
+_OK = b"OK"
+_ERROR = b"ERROR"
+_UNKNOWN_CODE = ErrorCode.UNKNOWN_COMMAND.value.encode()
+
+_context_configured = False
+_sockets: Dict[Tuple[asyncio.AbstractEventLoop, str], Socket] = {}
+_socket_locks: Dict[Tuple[asyncio.AbstractEventLoop, str], asyncio.Lock] = {}
+_dealer_sockets: Dict[Tuple[asyncio.AbstractEventLoop, str], Socket] = {}
+_dealer_locks: Dict[Tuple[asyncio.AbstractEventLoop, str], asyncio.Lock] = {}
+_metadata_cache: Dict[Tuple[str, str], Metadata] = {}
+_parsed_metadata: Dict[str, Metadata] = {}
+
+
 class ServiceException(Exception):
     """
     Represents an error that occurred during the execution of the service
@@ -64,30 +90,354 @@ async def call(endpoint: str, command: str, arguments: List[str] = []) -> List[s
                            was invalid.
         TimeoutException: The service function did not respond
                           within the timeout period.
+
+    The socket connected to the endpoint and the metadata describing
+    the command are cached, so repeated calls to the same service
+    function cost a single round-trip.  A REQ socket only allows one
+    request in flight, so concurrent calls to the same endpoint are
+    serialised on the socket's lock.
+    """
+    async with __lock_for(endpoint):
+        socket = __socket_for(endpoint)
+        if endpoint.startswith("inproc://"):
+            # An inproc peer lives in the same process and the
+            # transport is an in-memory queue, so the metadata
+            # round-trip exists only to pick a network timeout; skip
+            # it and block until the service replies.
+            socket.rcvtimeo = -1
+        else:
+            metadata = await __metadata_for_locked(endpoint, command)
+            socket.rcvtimeo = metadata.timeout.value
+        try:
+            return await __call_impl(socket, command.encode(), arguments)
+        except (TimeoutException, zmq.ZMQError):
+            # A REQ socket that missed a reply is stuck in its
+            # send/receive cycle and cannot be reused.
+            __discard_socket(endpoint)
+            raise
+
+
+async def call_many(endpoint: str, calls: List[Tuple[str, List[str]]]) -> List[List[str]]:
+    """
+    Calls several service functions in a pipeline over a single
+    DEALER socket.  All requests are sent before any reply is read,
+    so a batch of N calls costs roughly one round-trip instead of N.
+    The service processes requests in order and replies in order,
+    which is how replies are matched back to calls; the endpoint's
+    DEALER lock is held from first send to last reply so concurrent
+    batches take turns instead of consuming each other's replies.
+
+    Args:
+        endpoint: The endpoint to call.
+        calls: Pairs of service function name and arguments.
+
+    Returns:
+        The responses of the service functions, in call order.
+
+    Raises:
+        UnknownCommandException: One of the commands is invalid.
+        ProtocolException: A response from the service function was
+                           invalid.
+        TimeoutException: The service function did not respond
+                          within the timeout period.
+    """
+    async with __dealer_lock_for(endpoint):
+        socket = await __pipeline(endpoint, calls)
+
+        results: List[List[str]] = []
+        first_error: Optional[Exception] = None
+        try:
+            for _ in calls:
+                try:
+                    frames = await socket.recv_multipart()
+                except zmq.error.Again:
+                    raise TimeoutException(
+                        f'no response from service after '
+                        f'{int(socket.rcvtimeo)} ms')
+                if len(frames) == 0 or frames[0] != b"":
+                    raise ProtocolException(
+                        f'invalid reply envelope: {frames}')
+                try:
+                    results.append(__parse_reply(frames[1:]))
+                except Exception as error:
+                    # A failed reply raises the service-side exception
+                    # hierarchy, not just the local ServiceException.
+                    # Keep draining so the remaining replies do not
+                    # desync the socket, then report the first failure.
+                    if first_error is None:
+                        first_error = error
+        except BaseException:
+            # The batch is exiting with replies unaccounted for; they
+            # would be handed to the next batch as its own replies if
+            # the socket were reused.
+            __discard_dealer(endpoint)
+            raise
+    if first_error is not None:
+        raise first_error
+    return results
+
+
+async def call_all(endpoint: str, calls: List[Tuple[str, List[str]]]) -> List[List[str]]:
+    """
+    Calls several service functions concurrently over a single DEALER
+    socket, resolving each call's future as its reply arrives.  Like
+    `call_many`, the batch is pipelined so N calls cost roughly one
+    round-trip and the endpoint's DEALER lock is held for the whole
+    batch; unlike `call_many`, every call's outcome is captured
+    individually before the first failure, if any, is raised.
+
+    Args:
+        endpoint: The endpoint to call.
+        calls: Pairs of service function name and arguments.
+
+    Returns:
+        The responses of the service functions, in call order.
+
+    Raises:
+        UnknownCommandException: One of the commands is invalid.
+        ProtocolException: A response from the service function was
+                           invalid.
+        TimeoutException: The service function did not respond
+                          within the timeout period.
+    """
+    loop = asyncio.get_running_loop()
+    futures: List['asyncio.Future[List[str]]'] = [
+        loop.create_future() for _ in calls]
+
+    async def drain(socket: Socket) -> None:
+        try:
+            for future in futures:
+                try:
+                    frames = await socket.recv_multipart()
+                except zmq.error.Again:
+                    raise TimeoutException(
+                        f'no response from service after '
+                        f'{int(socket.rcvtimeo)} ms')
+                if len(frames) == 0 or frames[0] != b"":
+                    raise ProtocolException(
+                        f'invalid reply envelope: {frames}')
+                try:
+                    result = __parse_reply(frames[1:])
+                except Exception as error:
+                    # A failed reply raises the service-side exception
+                    # hierarchy (pyservice.ServiceException and its
+                    # subclasses), not the local ServiceException;
+                    # catch everything so the failure lands in the
+                    # future instead of killing the drain task and
+                    # leaving the gather below waiting forever.
+                    future.set_exception(error)
+                else:
+                    future.set_result(result)
+        except BaseException as exc:
+            # Any exit with replies unaccounted for -- timeout, a
+            # closed socket, a broken envelope -- must discard the
+            # socket and resolve every remaining future, or the
+            # gather below blocks forever.
+            __discard_dealer(endpoint)
+            failure = exc if isinstance(exc, Exception) \
+                else ProtocolException(f'reply drain aborted: {exc!r}')
+            for pending in futures:
+                if not pending.done():
+                    pending.set_exception(failure)
+
+    async with __dealer_lock_for(endpoint):
+        socket = await __pipeline(endpoint, calls)
+        drain_task = asyncio.create_task(drain(socket))
+        outcomes = await asyncio.gather(*futures, return_exceptions=True)
+        await drain_task
+    results: List[List[str]] = []
+    first_error: Optional[BaseException] = None
+    for outcome in outcomes:
+        if isinstance(outcome, BaseException):
+            if first_error is None:
+                first_error = outcome
+        else:
+            results.append(outcome)
+    if first_error is not None:
+        raise first_error
+    return results
+
+
+async def __pipeline(endpoint: str, calls: List[Tuple[str, List[str]]]) -> Socket:
+    """
+    Sends every call of the batch over the cached DEALER socket for
+    the endpoint without waiting for replies, with the receive
+    timeout set to the largest of the commands' timeouts.  Returns
+    the socket the replies will arrive on.
+    """
+    timeout = 300
+    for command, _ in calls:
+        metadata = await __metadata_for(endpoint, command)
+        timeout = max(timeout, metadata.timeout.value)
+
+    socket = __dealer_for(endpoint)
+    socket.rcvtimeo = timeout
+    for command, arguments in calls:
+        await socket.send_multipart(
+            [b"", command.encode(), *map(str.encode, arguments)])
+    return socket
+
+
+async def __metadata_for(endpoint: str, command: str) -> Metadata:
     """
+    Retrieves the metadata describing the given command of the
+    service at the given endpoint, consulting the cache first.  A
+    cache miss takes the endpoint's REQ lock for the round-trip.
+    """
+    metadata = _metadata_cache.get((endpoint, command))
+    if metadata is None:
+        async with __lock_for(endpoint):
+            metadata = await __metadata_for_locked(endpoint, command)
+    return metadata
+
+
+async def __metadata_for_locked(endpoint: str, command: str) -> Metadata:
+    """
+    The body of __metadata_for; the caller must hold the endpoint's
+    REQ lock.
+    """
+    cache_key = (endpoint, command)
+    metadata = _metadata_cache.get(cache_key)
+    if metadata is None:
+        socket = __socket_for(endpoint)
+        # Local transports round-trip in microseconds; keep the
+        # initial metadata timeout correspondingly tight.
+        socket.rcvtimeo = 50 if endpoint.startswith("ipc://") else 300
+        try:
+            metadata = await __metadata_impl(socket, command)
+        except (TimeoutException, zmq.ZMQError):
+            __discard_socket(endpoint)
+            raise
+        _metadata_cache[cache_key] = metadata
+    return metadata
+
+
+def __new_socket(socket_type: int) -> Socket:
+    """
+    Creates a socket of the given type on the shared context, with
+    the context and socket tuned for throughput: extra IO threads for
+    multi-endpoint workloads, a deep high-water mark and megabyte
+    kernel buffers so bursts of small messages do not stall.
+    """
+    global _context_configured
     context = Context.instance()
-    with context.socket(zmq.REQ) as socket:
-        socket.linger = 0
+    if not _context_configured:
+        # IO threads only take effect before the context starts its
+        # reactor, hence the once-per-process guard.
+        context.set(zmq.IO_THREADS, max(2, (os.cpu_count() or 4) // 4))
+        _context_configured = True
+    socket = context.socket(socket_type)
+    socket.linger = 0
+    socket.set_hwm(10_000)
+    socket.setsockopt(zmq.SNDBUF, 1 << 20)
+    socket.setsockopt(zmq.RCVBUF, 1 << 20)
+    socket.setsockopt(zmq.TCP_KEEPALIVE, 1)
+    return socket
+
+
+def __lock_for(endpoint: str) -> asyncio.Lock:
+    """
+    Retrieves the lock serialising use of the cached REQ socket for
+    the given endpoint, creating one on first use.  A REQ socket
+    enforces a strict send/receive cycle, so overlapping calls must
+    take turns rather than interleave on the socket.
+    """
+    key = (asyncio.get_running_loop(), endpoint)
+    lock = _socket_locks.get(key)
+    if lock is None:
+        lock = asyncio.Lock()
+        _socket_locks[key] = lock
+    return lock
+
+
+def __socket_for(endpoint: str) -> Socket:
+    """
+    Retrieves the cached REQ socket connected to the given endpoint,
+    creating and connecting one on first use.  Sockets are keyed by
+    the running event loop as well as the endpoint because REQ
+    sockets must not be shared between loops.
+    """
+    key = (asyncio.get_running_loop(), endpoint)
+    socket = _sockets.get(key)
+    if socket is None:
+        socket = __new_socket(zmq.REQ)
         socket.connect(endpoint)
+        _sockets[key] = socket
+    return socket
+
+
+def __discard_socket(endpoint: str) -> None:
+    """
+    Closes and forgets the cached socket for the given endpoint, if
+    any, so that the next call reconnects with a fresh one.
+    """
+    socket = _sockets.pop((asyncio.get_running_loop(), endpoint), None)
+    if socket is not None:
+        socket.close()
 
-        socket.rcvtimeo = 300
-        metadata = await __metadata_impl(socket, command)
-        socket.rcvtimeo = metadata.timeout.value
 
-        return await __call_impl(socket, command, arguments)
+def __dealer_lock_for(endpoint: str) -> asyncio.Lock:
+    """
+    Retrieves the lock serialising batches on the cached DEALER
+    socket for the given endpoint, creating one on first use.
+    Replies are matched to calls by position, so a batch must own the
+    socket from its first send to its last reply; concurrent batches
+    would otherwise consume each other's replies.
+    """
+    key = (asyncio.get_running_loop(), endpoint)
+    lock = _dealer_locks.get(key)
+    if lock is None:
+        lock = asyncio.Lock()
+        _dealer_locks[key] = lock
+    return lock
+
+
+def __dealer_for(endpoint: str) -> Socket:
+    """
+    Retrieves the cached DEALER socket connected to the given
+    endpoint, creating and connecting one on first use.
+    """
+    key = (asyncio.get_running_loop(), endpoint)
+    socket = _dealer_sockets.get(key)
+    if socket is None:
+        socket = __new_socket(zmq.DEALER)
+        socket.connect(endpoint)
+        _dealer_sockets[key] = socket
+    return socket
+
+
+def __discard_dealer(endpoint: str) -> None:
+    """
+    Closes and forgets the cached DEALER socket for the given
+    endpoint, if any.
+    """
+    socket = _dealer_sockets.pop(
+        (asyncio.get_running_loop(), endpoint), None)
+    if socket is not None:
+        socket.close()
 
 
 async def __metadata_impl(socket: Socket, command: str) -> Metadata:
-    response = await __call_impl(socket, "metadata", [command])
+    response = await __call_impl(socket, _METADATA_CMD, [command])
     try:
-        return Metadata.from_dictionary(json.loads(response[0]))
+        raw = response[0]
     except IndexError:
         raise ProtocolException(
             f'invalid metadata response: {response}')
+    metadata = _parsed_metadata.get(raw)
+    if metadata is None:
+        metadata = Metadata.from_dictionary(__loads(raw))
+        _parsed_metadata[raw] = metadata
+    return metadata
 
 
-async def __call_impl(socket: Socket, command: str, arguments: List[str]) -> List[str]:
-    await socket.send_multipart([command.encode()] + [arg.encode() for arg in arguments])
+async def __call_impl(socket: Socket, command: bytes, arguments: List[str]) -> List[str]:
+    if arguments:
+        await socket.send_multipart([command, *map(str.encode, arguments)])
+    else:
+        # A call without arguments is a single-frame message; plain
+        # send skips the per-frame multipart bookkeeping.
+        await socket.send(command)
 
     try:
         response = await socket.recv_multipart()
@@ -95,21 +445,47 @@ async def __call_impl(socket: Socket, command: str, arguments: List[str]) -> Lis
         raise TimeoutException(
             f'no response from service after {int(socket.rcvtimeo)} ms')
 
+    return __parse_reply(response)
+
+
+def __parse_reply(response: List[bytes]) -> List[str]:
     if len(response) > 0:
-        if response[0] == b"OK":
-            return [arg.decode() for arg in response[1:]]
-        elif response[0] == b"ERROR":
-            if len(response) == 3:
-                error_code = response[1].decode()
-                error_message = response[2].decode()
-                if error_code == ErrorCode.UNKNOWN_COMMAND.value:
-                    raise UnknownCommandException(error_message)
-                else:
-                    raise ServiceException(error_code, error_message)
-            else:
-                raise ProtocolException(
-                    f'invalid error response: {response}')
-        else:
+        # Dispatch on the first byte of the status frame; the happy
+        # path pays one byte lookup instead of full bytes compares.
+        handler = _REPLY_HANDLERS.get(response[0][0]) if response[0] else None
+        if handler is None:
             raise ProtocolException(f'invalid response: {response}')
+        return handler(response)
     else:
         raise ProtocolException(f'empty response')
+
+
+def __handle_ok(response: List[bytes]) -> List[str]:
+    if response[0] != _OK:
+        raise ProtocolException(f'invalid response: {response}')
+    return [arg.decode() for arg in response[1:]]
+
+
+def __handle_error(response: List[bytes]) -> List[str]:
+    if response[0] != _ERROR:
+        raise ProtocolException(f'invalid response: {response}')
+    if len(response) == 3:
+        factory = _ERROR_MAP.get(response[1])
+        if factory is not None:
+            raise factory(response[2].decode())
+        else:
+            raise ServiceException(
+                response[1].decode(), response[2].decode())
+    else:
+        raise ProtocolException(
+            f'invalid error response: {response}')
+
+
+_REPLY_HANDLERS = {
+    _OK[0]: __handle_ok,
+    _ERROR[0]: __handle_error,
+}
+
+_ERROR_MAP: Dict[bytes, Callable[[str], Exception]] = {
+    _UNKNOWN_CODE: UnknownCommandException,
+}
@@ -21,25 +21,21 @@ from typing import Dict, List, Union
 
 
 class Headers(dict):
+    """
+    A mapping of email headers whose keys are normalised to lower
+    case when the instance is built, so lookups run at plain dict
+    speed.  Look headers up by their lower-cased names.
+    """
+
     @staticmethod
     def from_email_headers(headers: List[Dict[str, str]]) -> 'Headers':
-        instance = Headers()
-        for header in headers:
-            instance[header["name"]] = header["value"]
-        return instance
+        return Headers(
+            (header["name"].lower(), header["value"]) for header in headers)
 
     @staticmethod
     def from_dictionary(headers: Dict[str, str]) -> 'Headers':
-        instance = Headers()
-        for key, value in headers.items():
-            instance[key] = value
-        return instance
-
-    def __getitem__(self, key):
-        return super().__getitem__(key.lower())
-
-    def __setitem__(self, key, value):
-        super().__setitem__(key.lower(), value)
+        return Headers(
+            (key.lower(), value) for key, value in headers.items())
 
 
 @dataclass
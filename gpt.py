@@ -16,8 +16,20 @@
 # along with this program.  If not, see <https://www.gnu.org/licenses/>.
 #
 
+import sys
 from typing import Dict
 
+try:
+    import orjson
+
+    def _dumps(value: Dict[str, str]) -> bytes:
+        return orjson.dumps(value)
+except ImportError:
+    import json
+
+    def _dumps(value: Dict[str, str]) -> bytes:
+        return json.dumps(value).encode()
+
 
 class Message:
     """
@@ -32,19 +44,43 @@ class Message:
     :type text: str
     """
 
+    __slots__ = ("role", "text", "_dictionary", "_json_bytes")
+
     def __init__(self, role: str, text: str):
         self.role = role
         self.text = text
+        self._dictionary: Dict[str, str] | None = None
+        self._json_bytes: bytes | None = None
 
     def to_dictionary(self) -> Dict[str, str]:
         """
         Converts the message to a dictionary containing the message
-        role and text content.
+        role and text content.  Messages are effectively immutable,
+        so the dictionary is built once and reused on later calls.
 
         Returns:
             A dictionary containing the message role and text content.
         """
-        return {"role": self.role, "content": self.text}
+        dictionary = self._dictionary
+        if dictionary is None:
+            dictionary = {"role": self.role, "content": self.text}
+            self._dictionary = dictionary
+        return dictionary
+
+    def to_json_bytes(self) -> bytes:
+        """
+        Converts the message to its JSON encoding as bytes, caching
+        the result.  Serialising a conversation can join these cached
+        chunks instead of re-encoding every message.
+
+        Returns:
+            The JSON encoding of the message as bytes.
+        """
+        json_bytes = self._json_bytes
+        if json_bytes is None:
+            json_bytes = _dumps(self.to_dictionary())
+            self._json_bytes = json_bytes
+        return json_bytes
 
     @staticmethod
     def from_dictionary(data: Dict[str, str]) -> 'Message':
@@ -53,25 +89,8 @@ class Message:
         return Message(role=role, text=text)
 
 
-class SystemMessage(Message):
-    """Represents a system message."""
-
-    def __init__(self, text: str):
-        super().__init__("system", text)
-
-
-class UserMessage(Message):
-    """Represents a user message."""
-
-    def __init__(self, text: str):
-        super().__init__("user", text)
-
-
-class AssistantMessage(Message):
-    """Represents an assistant message."""
-
-    def __init__(self, text: str):
-        super().__init__("assistant", text)
+_ROLES = {role: sys.intern(role)
+          for role in ("system", "user", "assistant")}
 
 
 def build_message(role: str, content: str) -> Message:
@@ -91,11 +110,7 @@ def build_message(role: str, content: str) -> Message:
     Raises:
         ValueError: If the role provided is invalid.
     """
-    if role == 'system':
-        return SystemMessage(content)
-    elif role == 'user':
-        return UserMessage(content)
-    elif role == 'assistant':
-        return AssistantMessage(content)
-    else:
+    try:
+        return Message(_ROLES[role], content)
+    except KeyError:
         raise ValueError(f"Invalid role: {role}")
@@ -18,7 +18,7 @@
 
 from dataclasses import dataclass
 from enum import Enum
-from typing import Any, Dict, List, Union, assert_never
+from typing import Any, Callable, Dict, List, Union
 
 
 class Timeout(Enum):
@@ -26,7 +26,7 @@ class Timeout(Enum):
     LONG = 30000
 
 
-@dataclass
+@dataclass(frozen=True, slots=True)
 class Argument:
     """
     Represents an argument to a service command.
@@ -49,7 +49,7 @@ class Argument:
         return Argument(dictionary['name'], dictionary['description'])
 
 
-@dataclass
+@dataclass(frozen=True, slots=True)
 class VariableLengthArguments:
     """
     Represents arguments of variable length of the same type.
@@ -57,7 +57,7 @@ class VariableLengthArguments:
     inner: Argument
 
 
-@dataclass
+@dataclass(slots=True)
 class Arguments:
     """
     Represents the complete set of arguments to a service command.
@@ -119,32 +119,43 @@ class Arguments:
         :return: The arguments as a dictionary.
         :rtype: Dict[str, Any]
         """
-        match self.inner:
-            case None:
-                return {'type': 'none'}
-            case VariableLengthArguments(inner):
-                return {'type': 'variable_length', 'argument': inner.to_dictionary()}
-            case list:
-                return {'type': 'list', 'arguments': [item.to_dictionary() for item in list]}
+        inner = self.inner
+        if inner is None:
+            return {'type': 'none'}
+        elif isinstance(inner, VariableLengthArguments):
+            return {'type': 'variable_length',
+                    'argument': inner.inner.to_dictionary()}
+        else:
+            return {'type': 'list',
+                    'arguments': [item.to_dictionary() for item in inner]}
 
     @staticmethod
     def from_dictionary(dictionary: Dict[str, Any]) -> 'Arguments':
         """
         Constructs an instance of the class from a dictionary.
         """
-        match dictionary['type']:
-            case 'none':
-                return Arguments()
-            case 'variable_length':
-                return Arguments.variable_length(Argument.from_dictionary(dictionary['argument']))
-            case 'list':
-                list: List[dict[str, str]] = dictionary['arguments']
-                return Arguments(*[Argument.from_dictionary(item) for item in list])
-            case unreachable:
-                assert_never(unreachable)
-
-
-@dataclass
+        tag = dictionary['type']
+        try:
+            builder = _ARGUMENTS_BUILDERS[tag]
+        except KeyError:
+            raise ValueError(f'unknown arguments type: {tag}')
+        return builder(dictionary)
+
+
+_ARGUMENTS_BUILDERS: Dict[str, Callable[[Dict[str, Any]], Arguments]] = {
+    'none':
+        lambda dictionary: Arguments(),
+    'variable_length':
+        lambda dictionary: Arguments.variable_length(
+            Argument.from_dictionary(dictionary['argument'])),
+    'list':
+        lambda dictionary: Arguments(
+            *[Argument.from_dictionary(item)
+              for item in dictionary['arguments']]),
+}
+
+
+@dataclass(frozen=True, slots=True)
 class Metadata:
     name: str
     description: str
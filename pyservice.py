@@ -16,8 +16,8 @@
 # along with this program.  If not, see <https://www.gnu.org/licenses/>.
 #
 
-from enum import Enum
-from typing import Callable, Dict, List, Optional, Union
+from enum import Enum, IntEnum
+from typing import Callable, Dict, List, Optional, Sequence, Union
 
 from pyservice.metadata import Metadata
 
@@ -84,7 +84,7 @@ class ErrorCode(Enum):
     UNCATEGORISED = "ERROR_UNCATEGORISED"
 
 
-class State(Enum):
+class State(IntEnum):
     SENDING = 0
     RECEIVING = 1
 
@@ -104,4 +104,4 @@ class UnknownCommandException(ServiceException):
             ErrorCode.UNKNOWN_COMMAND, command)
 
 
-CommandInfo = Dict[str, Union[Callable[[List[str]], List[str]], Metadata]]
+CommandInfo = Dict[str, Union[Callable[[List[str]], Sequence[Union[str, bytes]]], Metadata]]
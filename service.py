@@ -16,21 +16,104 @@
 # along with this program.  If not, see <https://www.gnu.org/licenses/>.
 #
 
+import asyncio
 import json
+import logging
+import os
 import subprocess
 import sys
 from enum import Enum
-from typing import Callable, Dict, List, Optional
+from functools import lru_cache
+from typing import (Callable, Dict, List, Optional, Sequence, Union,
+                    cast)
 
 import zmq
 from zmq.asyncio import Context, Socket
 
 from pyservice import (CommandInfo, ErrorCode, FatalServiceError,
-                       ServiceException, State, StateException,
-                       UnknownCommandException)
+                       ServiceException, UnknownCommandException)
 from pyservice.metadata import (Argument, Arguments, Metadata, Timeout,
                                 VariableLengthArguments)
 
+try:
+    # Must run before the event loop is created, hence at import.
+    import uvloop
+    uvloop.install()
+except ImportError:
+    pass
+
+try:
+    import orjson
+
+    def _dumps(value: Dict[str, object]) -> bytes:
+        return orjson.dumps(value)
+except ImportError:
+    def _dumps(value: Dict[str, object]) -> bytes:
+        return json.dumps(value).encode()
+
+
+logger = logging.getLogger(__name__)
+
+# Wire encodings of the predefined error codes, computed once so the
+# error path does not re-encode the enum value per reply.
+_ERROR_CODE_BYTES: Dict[Enum, bytes] = {
+    code: code.value.encode() for code in ErrorCode}
+
+_UNCATEGORISED_BYTES = _ERROR_CODE_BYTES[ErrorCode.UNCATEGORISED]
+
+
+@lru_cache(maxsize=256)
+def _format_exc(module: str, name: str, message: str) -> bytes:
+    """
+    Formats and encodes the diagnostic payload for an unexpected
+    exception.  Services that raise the same exceptions as control
+    flow hit the cache instead of rebuilding the string per reply.
+    """
+    return f'{module}.{name}: {message}'.encode()
+
+
+def _build_help(command: str, metadata: Metadata) -> str:
+    """
+    Builds the help block for a command from its metadata.  Called
+    once at registration time; the result is cached on the command
+    info.
+    """
+    parts = [f'**{command}**\\\n',
+             f'{metadata.description}\\\n']
+    if metadata.timeout.value > 300:
+        parts.append('Can take a long time to run.\\\n')
+    parts.append('\\\n**Arguments**\\\n')
+    match metadata.arguments.inner:
+        case None:
+            parts.append('None\\\n')
+        case VariableLengthArguments(argument):
+            parts.append(
+                'This function accepts one or more of the following argument:\\\n')
+            parts.append(
+                f'*{argument.name}* - {argument.description}\\\n')
+        case arguments:
+            for argument in arguments:
+                parts.append(
+                    f'*{argument.name}* - {argument.description}\\\n')
+    parts.append('\\\n**Returns**\\\n')
+    parts.append(f'{metadata.returns}\\\n\\\n')
+    parts.append('**Errors**\\\n')
+    parts.append(metadata.errors)
+    return ''.join(parts)
+
+
+def _announce_port(address: str) -> None:
+    """
+    Copies the assigned port number or endpoint to the clipboard on
+    macOS.  Runs in an executor thread so the blocking subprocess
+    does not stall the event loop.
+    """
+    try:
+        subprocess.run(['pbcopy'], input=address.encode(),
+                       check=False)
+    except FileNotFoundError:
+        pass
+
 
 class Service:
     """
@@ -39,6 +122,18 @@ class Service:
 
     def __init__(self: 'Service'):
         self.command_map: Dict[str, CommandInfo] = {}
+        self._handlers: Dict[
+            str, Callable[..., Sequence[Union[str, bytes]]]] = {}
+        self._metadata_json: Dict[str, bytes] = {}
+        self._help_texts: Dict[str, str] = {}
+        self._binary_commands: set = set()
+        self._slow_commands: set = set()
+        self._bytes_response_commands: set = set()
+        self._help_cache: Optional[List[str]] = None
+        self._list_cache: Optional[List[str]] = None
+        self._help_cache_bytes: Optional[List[bytes]] = None
+        self._list_cache_bytes: Optional[List[bytes]] = None
+        self._reply_chains: Dict[bytes, 'asyncio.Future[None]'] = {}
         self.__register_common_commands()
 
     def __register_common_commands(self: 'Service') -> None:
@@ -55,27 +150,29 @@ class Service:
             ))
         self.register_command(
             'list',
-            lambda args: self.list(),
+            lambda args: self.__list_encoded(),
             Metadata(
                 'list',
                 'Lists the available service commands.',
                 Timeout.DEFAULT,
                 Arguments.none(),
                 'A list of available service commands.',
-                'None'))
+                'None'),
+            returns_bytes=True)
         self.register_command(
             'help',
-            lambda args: self.help_screen(),
+            lambda args: self.__help_encoded(),
             Metadata(
                 'help',
                 'Describes the available service commands.',
                 Timeout.DEFAULT,
                 Arguments.none(),
                 'A list of strings describing the available service commands.',
-                '*RuntimeError* - metadata is missing or invalid.'))
+                '*RuntimeError* - metadata is missing or invalid.'),
+            returns_bytes=True)
         self.register_command(
             'metadata',
-            lambda args: self.metadata(args),
+            self.metadata,
             Metadata(
                 'metadata',
                 'Returns metadata for the provided list of commands.',
@@ -84,19 +181,18 @@ class Service:
                     Argument('command', 'The command to retrieve metadata for.')),
                 'A list of metadata for the commmands in JSON',
                 '''*ValueError* - arguments are empty.\\
-                   *RuntimeError* - metadata is missing.'''))
-
-    def __get_command_info(self, command: str) -> CommandInfo:
-        try:
-            return self.command_map[command]
-        except KeyError:
-            raise UnknownCommandException(command)
-
-    async def __ok(self, array: List[str]) -> None:
-        await self.socket.send_multipart([b"OK"] + [arg.encode() for arg in array])
-
-    async def __error(self, code: Enum, message: str, context: Optional[str] = None) -> None:
-        await self.socket.send_multipart([b"ERROR", code.value.encode(), message.encode()] + ([context.encode()] if context else []))
+                   *RuntimeError* - metadata is missing.'''),
+            returns_bytes=True)
+
+    def __error(self, code: Enum, message: str, context: Optional[str] = None) -> List[bytes]:
+        code_bytes = _ERROR_CODE_BYTES.get(code)
+        if code_bytes is None:
+            # Services may raise with their own error-code enums.
+            code_bytes = code.value.encode()
+        frames = [b"ERROR", code_bytes, message.encode()]
+        if context:
+            frames.append(context.encode())
+        return frames
 
     def name(self) -> str:
         """
@@ -127,47 +223,43 @@ class Service:
         ]
 
     def list(self: 'Service') -> List[str]:
-        return list(self.command_map.keys())
+        if self._list_cache is None:
+            self._list_cache = list(self.command_map.keys())
+        return self._list_cache
+
+    def __list_encoded(self: 'Service') -> List[bytes]:
+        """
+        Retrieves the response of the list command with its frames
+        already encoded, so replies skip the per-call encoding.
+        """
+        if self._list_cache_bytes is None:
+            self._list_cache_bytes = [name.encode() for name in self.list()]
+        return self._list_cache_bytes
+
+    def __help_encoded(self: 'Service') -> List[bytes]:
+        """
+        Retrieves the response of the help command with its frames
+        already encoded, so replies skip the per-call encoding.
+        """
+        if self._help_cache_bytes is None:
+            self._help_cache_bytes = [
+                text.encode() for text in self.help_screen()]
+        return self._help_cache_bytes
 
     def help_screen(self: 'Service') -> List[str]:
         """
-        Retrieves a help screen for the service.
+        Retrieves a help screen for the service.  The per-command
+        help blocks are built at registration time, so this only
+        collects them.
 
         Returns:
             A list of strings describing the available service commands.
-
-        Raises:
-            RuntimeError: metadata is missing or invalid.
         """
-        response: List[str] = []
-        for command, command_info in self.command_map.items():
-            metadata = command_info.get('metadata')
-            if metadata and isinstance(metadata, Metadata):
-                help_string = f'**{command}**\\\n'
-                help_string += f'{metadata.description}\\\n'
-                if metadata.timeout.value > 300:
-                    help_string += 'Can take a long time to run.\\\n'
-                help_string += '\\\n**Arguments**\\\n'
-                match metadata.arguments.inner:
-                    case None:
-                        help_string += 'None\\\n'
-                    case VariableLengthArguments(argument):
-                        help_string += 'This function accepts one or more of the following argument:\\\n'
-                        help_string += f'*{argument.name}* - {argument.description}\\\n'
-                    case arguments:
-                        for argument in arguments:
-                            help_string += f'*{argument.name}* - {argument.description}\\\n'
-                help_string += '\\\n**Returns**\\\n'
-                help_string += f'{metadata.returns}\\\n\\\n'
-                help_string += '**Errors**\\\n'
-                help_string += metadata.errors
-                response.append(help_string)
-            else:
-                raise RuntimeError(
-                    f'metadata missing or invalid for {command}')
-        return response
+        if self._help_cache is None:
+            self._help_cache = list(self._help_texts.values())
+        return self._help_cache
 
-    def metadata(self: 'Service', arguments: List[str]) -> List[str]:
+    def metadata(self: 'Service', arguments: List[str]) -> List[bytes]:
         """
         Retrieves metadata for specified service functions.
 
@@ -176,30 +268,25 @@ class Service:
             retrieve metadata for.
 
         Returns:
-            A list of metadata for the specified service functions, as a
-            JSON-encoded string.
+            A list of metadata for the specified service functions,
+            each JSON-encoded as bytes ready to go on the wire.
 
         Raises:
             ValueError: arguments are empty.
             RuntimeError: metadata is missing.
         """
         if len(arguments) > 0:
-            return [json.dumps(self.__metadata_impl(command).to_dictionary()) for command in arguments]
+            metadata_json = self._metadata_json
+            try:
+                return [metadata_json[command] for command in arguments]
+            except KeyError:
+                raise UnknownCommandException(
+                    next(command for command in arguments
+                         if command not in metadata_json))
         else:
             raise ValueError("Expected one or more commands as arguments")
 
-    def __metadata_impl(self: 'Service', function_name: str) -> Metadata:
-        command = self.command_map.get(function_name)
-        if command:
-            metadata = command.get('metadata')
-            if metadata and isinstance(metadata, Metadata):
-                return metadata
-            else:
-                raise RuntimeError(f'metadata missing for {function_name}')
-        else:
-            raise UnknownCommandException(function_name)
-
-    def register_command(self, command: str, handler: Callable[[List[str]], List[str]], metadata: Metadata) -> None:
+    def register_command(self, command: str, handler: Callable[..., Sequence[Union[str, bytes]]], metadata: Metadata, binary: bool = False, returns_bytes: bool = False) -> None:
         """
         Registers a command with the service.  Replaces any existing
         command with the same name.
@@ -208,22 +295,67 @@ class Service:
             command: The name of the command.
             handler: The function to call when the command is received.
             metadata: The metadata for the command.
+            binary: If True, the handler receives the raw bytes of the
+                    argument frames instead of decoded strings,
+                    skipping a decode of every frame on the request
+                    path, and is expected to return bytes frames.
+            returns_bytes: If True, the handler's response frames are
+                           all bytes and go on the wire untouched,
+                           skipping the per-frame encode check.
+                           Implied by binary.
         """
+        if not callable(handler):
+            raise TypeError(f'handler for {command} is not callable')
+        command = sys.intern(command)
         self.command_map[command] = {
             'handler': handler,
-            'metadata': metadata
+            'metadata': metadata,
         }
+        self._handlers[command] = handler
+        # Metadata is immutable, so its JSON encoding and help block
+        # can be produced once here instead of per request.
+        self._metadata_json[command] = _dumps(metadata.to_dictionary())
+        self._help_texts[command] = _build_help(command, metadata)
+        if binary:
+            self._binary_commands.add(command)
+        else:
+            self._binary_commands.discard(command)
+        if metadata.timeout.value > 300:
+            self._slow_commands.add(command)
+        else:
+            self._slow_commands.discard(command)
+        if binary or returns_bytes:
+            self._bytes_response_commands.add(command)
+        else:
+            self._bytes_response_commands.discard(command)
+        self._help_cache = None
+        self._list_cache = None
+        self._help_cache_bytes = None
+        self._list_cache_bytes = None
 
-    async def run(self, port: Optional[int] = None) -> None:
+    async def run(self, port: Optional[int] = None, transport: Optional[str] = None) -> None:
         """
         Runs the service asynchronously.  If port is None, the service
         will listen for requests on a random port, and will print the
         port number to stdout.  The port number will also be copied to
         the clipboard on macOS.
 
+        The service listens on a ROUTER socket, so several requests
+        can be in flight at once; each request is dispatched on its
+        own task and replies carry the identity envelope of their
+        requester.
+
         :param port: The port to listen on.  If None, a random port
                      will be used.
         :type port: Optional[int]
+        :param transport: The transport to serve on, 'tcp' or 'ipc'.
+                          If None, the PYSERVICE_TRANSPORT environment
+                          variable decides, defaulting to 'tcp'.  With
+                          'ipc' the service binds a socket file under
+                          /tmp, prints the endpoint to stdout and
+                          ignores port; local clients skip the TCP
+                          stack entirely.
+        :type transport: Optional[str]
 
         :return: None
         :rtype: None
@@ -231,8 +363,26 @@ class Service:
         context = Context.instance()
 
         # Create a socket for the server
-        socket: Socket = context.socket(zmq.REP)
-        if port is None:
+        socket: Socket = context.socket(zmq.ROUTER)
+        socket.set_hwm(int(os.environ.get('PYSERVICE_HWM', 1000)))
+        socket.setsockopt(
+            zmq.LINGER, int(os.environ.get('PYSERVICE_LINGER_MS', 0)))
+        socket.setsockopt(zmq.TCP_KEEPALIVE, 1)
+        if transport is None:
+            transport = os.environ.get('PYSERVICE_TRANSPORT', 'tcp')
+        if transport == 'ipc':
+            endpoint = f'ipc:///tmp/pyservice-{os.getpid()}.sock'
+            socket.bind(endpoint)
+            self.socket = socket
+
+            # Print the endpoint to stdout
+            print(endpoint)
+            if sys.platform == 'darwin':
+                await asyncio.get_running_loop().run_in_executor(
+                    None, _announce_port, endpoint)
+        elif transport != 'tcp':
+            raise ValueError(f'unknown transport: {transport}')
+        elif port is None:
             socket.bind("tcp://*:0")
             self.socket = socket
 
@@ -241,68 +391,160 @@ class Service:
             assert (isinstance(port_bytes, bytes))
             assigned_port: str = port_bytes.decode().rsplit(":", 1)[-1]
             print(assigned_port)
-            subprocess.call(
-                f'/bin/echo -n {assigned_port} | pbcopy', shell=True)
+            if sys.platform == 'darwin':
+                await asyncio.get_running_loop().run_in_executor(
+                    None, _announce_port, assigned_port)
         else:
             socket.bind(f"tcp://*:{port}")
             self.socket = socket
 
-        state: State = State.RECEIVING
+        # Bind the send method once; the reply helpers call it on
+        # every message.
+        self._send = socket.send_multipart
+
+        self._fatal: Optional[FatalServiceError] = None
+        self._pending_recv: Optional['asyncio.Future'] = None
+        self._tasks: set = set()
 
-        while True:
+        try:
+            while True:
+                if self._fatal is not None:
+                    raise self._fatal
+                try:
+                    # Wait for a request from a client.  copy=False
+                    # yields frames backed by the zmq buffer, so the
+                    # identity envelope is echoed without a copy and
+                    # argument bytes are only materialised on demand.
+                    # The pending receive is kept so a fatal handler
+                    # can cancel it and wake the loop at once; pyzmq
+                    # types it as a bare Awaitable, but the asyncio
+                    # socket hands out a Future.
+                    pending = cast('asyncio.Future',
+                                   socket.recv_multipart(copy=False))
+                    self._pending_recv = pending
+                    message = await pending
+                except asyncio.CancelledError:
+                    if self._fatal is not None:
+                        raise self._fatal
+                    raise
+                except KeyboardInterrupt:
+                    break
+                self.__spawn(message)
+
+                # Drain any requests already queued on the socket so a
+                # burst is dispatched in one loop turn instead of
+                # paying an event-loop wakeup per message.
+                while True:
+                    try:
+                        message = await socket.recv_multipart(
+                            zmq.NOBLOCK, copy=False)
+                    except zmq.error.Again:
+                        break
+                    self.__spawn(message)
+        finally:
+            if self._tasks:
+                # Let in-flight dispatches finish their replies
+                # before the socket goes away.
+                await asyncio.gather(*tuple(self._tasks),
+                                     return_exceptions=True)
+            # Close without lingering so the port is released at once
+            # and a restarted service can bind immediately.
+            socket.close(0)
+
+    def __spawn(self, message: List[zmq.Frame]) -> None:
+        """
+        Dispatches a request on its own task, tracked so the receive
+        loop can wait for in-flight replies before closing the
+        socket.
+        """
+        task = asyncio.ensure_future(self.__dispatch(message))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def __dispatch(self, message: List[zmq.Frame]) -> None:
+        """
+        Handles a single request and sends the reply back along the
+        identity envelope the ROUTER socket attached to it.  The
+        message arrives as unconsumed zmq frames; the envelope is
+        passed through to the reply untouched and the arguments are
+        decoded only as far as the handler needs.
+
+        Clients match replies to requests by position, so the replies
+        to one client must leave in the order its requests arrived
+        even when a slow handler finishes after a later fast one.
+        Handlers still run concurrently; each reply only waits for
+        the preceding reply to the same client to be sent.
+        """
+        envelope = message[:2]
+        identity = message[0].bytes
+        previous = self._reply_chains.get(identity)
+        turn: 'asyncio.Future[None]' = \
+            asyncio.get_running_loop().create_future()
+        self._reply_chains[identity] = turn
+        try:
+            reply = await self.__handle(message)
+            if reply is not None:
+                if previous is not None:
+                    await previous
+                await self._send([*envelope, *reply])
+        finally:
+            if self._reply_chains.get(identity) is turn:
+                del self._reply_chains[identity]
+            turn.set_result(None)
+
+    async def __handle(self, message: List[zmq.Frame]) -> Optional[List[bytes]]:
+        """
+        Runs the handler for a single request and returns the reply
+        frames, status first, without the identity envelope, or None
+        for a fatal error, which gets no reply.  Other errors are
+        rendered into ERROR replies here so __dispatch has a single,
+        ordered send point.
+        """
+        try:
+            # Interned at registration too, so the handler lookup
+            # compares pointers rather than characters.
+            command = sys.intern(message[2].bytes.decode('ascii'))
+
+            logger.debug("received command %s", command)
+
+            # Process the request
             try:
-                # Wait for a request from a client
-                if state == State.RECEIVING:
-                    message = await socket.recv_multipart()
-                    state = State.SENDING
-                else:
-                    raise StateException(state)
-
-                command = message[0].decode()
-                arguments = [arg.decode() for arg in message[1:]]
-
-                print("received command", command, file=sys.stderr)
-
-                # Process the request
-                command_info = self.__get_command_info(command)
-                handler = command_info.get('handler')
-                if handler and callable(handler):
-                    response = handler(arguments)
-
-                    # Send the response back to the client
-                    if state == State.SENDING:
-                        await self.__ok(response)
-                        state = State.RECEIVING
-                    else:
-                        raise StateException(state)
-                else:
-                    raise RuntimeError(
-                        f'handler missing or not valid for {command}')
-
-            except KeyboardInterrupt:
-                break
-            except StateException as e:
-                print("Illegal state: ", e.state, file=sys.stderr)
-                exit(1)
-            except ServiceException as e:
-                error_response = str(e)
-                if state == State.SENDING:
-                    await self.__error(e.error_code, e.args[0], context=e.context)
-                    state = State.RECEIVING
-                else:
-                    print("Illegal state: ", state, file=sys.stderr)
-                    print("While trying to respond with error message: ",
-                          error_response, file=sys.stderr)
-            except FatalServiceError:
-                raise
-            except Exception as e:
-                # Handle any other errors that occur during processing
-                error_response = f'{type(Exception()).__module__}.{type(e).__name__}: {str(e)}'
-                print(error_response, file=sys.stderr)
-                if state == State.SENDING:
-                    await self.__error(ErrorCode.UNCATEGORISED, error_response)
-                    state = State.RECEIVING
-                else:
-                    print("Illegal state: ", state, file=sys.stderr)
-                    print("While trying to respond with error message: ",
-                          error_response, file=sys.stderr)
+                handler = self._handlers[command]
+            except KeyError:
+                raise UnknownCommandException(command)
+            arguments: Union[List[str], List[bytes]]
+            if command in self._binary_commands:
+                arguments = [frame.bytes for frame in message[3:]]
+            else:
+                arguments = [frame.bytes.decode() for frame in message[3:]]
+            if command in self._slow_commands:
+                # A long-running handler would block every other
+                # request; give it a thread of its own.
+                response = await asyncio.get_running_loop().run_in_executor(
+                    None, handler, arguments)
+            else:
+                response = handler(arguments)
+            if command in self._bytes_response_commands:
+                # The returns_bytes contract guarantees bytes frames.
+                return [b"OK", *cast(Sequence[bytes], response)]
+            return [b"OK",
+                    *(arg if isinstance(arg, bytes) else arg.encode()
+                      for arg in response)]
+        except ServiceException as e:
+            return self.__error(e.error_code, e.args[0],
+                                context=e.context)
+        except FatalServiceError as e:
+            # Dispatch runs on its own task; record the error and
+            # cancel the pending receive so the loop aborts now
+            # rather than when the next request happens to arrive.
+            self._fatal = e
+            pending = self._pending_recv
+            if pending is not None and not pending.done():
+                pending.cancel()
+            return None
+        except Exception as e:
+            # Handle any other errors that occur during processing
+            cls = type(e)
+            logger.error('%s.%s: %s', cls.__module__, cls.__name__, e)
+            return [b"ERROR", _UNCATEGORISED_BYTES,
+                    _format_exc(cls.__module__, cls.__name__, str(e))]